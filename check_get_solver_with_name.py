@@ -1,4 +1,3 @@
-from __future__ import print_function
 # Check that the backend can be obtained by passing solver='coin' to get_solver.
 from sage.numerical.backends.generic_backend import get_solver
 from sage_numerical_backends_coin.coin_backend import CoinBackend
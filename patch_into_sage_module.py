@@ -1,4 +1,3 @@
-from __future__ import print_function
 import os
 import sage.numerical.backends as dm
 import sage_numerical_backends_coin.coin_backend as sm
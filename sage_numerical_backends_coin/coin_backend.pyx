@@ -26,6 +26,7 @@ COIN Backend
 #                  https://www.gnu.org/licenses/
 #*****************************************************************************
 
+cimport cython
 from cysignals.memory cimport check_malloc, sig_free
 from cysignals.signals cimport sig_on, sig_off
 
@@ -680,6 +681,7 @@ cdef class CoinBackend(GenericBackend):
                 ub[i] if ub[i] != + self.si.getInfinity() else None)
 
     IF HAVE_ADD_COL_UNTYPED_ARGS:
+        @cython.boundscheck(True)
         cpdef add_col(self, indices, coeffs) noexcept:
             r"""
             Adds a column.
@@ -743,6 +745,7 @@ cdef class CoinBackend(GenericBackend):
             sig_free(c_indices)
             sig_free(c_values)
     ELSE:
+        @cython.boundscheck(True)
         cpdef add_col(self, list list_indices, list list_coeffs) noexcept:
             r"""
             Adds a column.
@@ -1280,6 +1283,7 @@ cdef class CoinBackend(GenericBackend):
             else:
                 self.prob_name = str(name)
 
+    @cython.boundscheck(True)
     cpdef row_name(self, int index):
         r"""
         Returns the ``index`` th row name
@@ -1301,6 +1305,7 @@ cdef class CoinBackend(GenericBackend):
         else:
             return ""
 
+    @cython.boundscheck(True)
     cpdef col_name(self, int index):
         r"""
         Returns the ``index`` th col name
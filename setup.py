@@ -3,8 +3,17 @@
 
 import os
 import sys
+import glob
+import hashlib
+import importlib.util
+import json
+import platform
+import shutil
+import subprocess
+from collections import defaultdict
 from setuptools import setup
 from setuptools import Extension
+from setuptools.command.build_ext import build_ext
 from setuptools.command.test import test as TestCommand # for tests
 from Cython.Build import cythonize
 from Cython.Compiler.Errors import CompileError
@@ -17,15 +26,74 @@ class SageTest(TestCommand):
         # Passing optional=sage avoids using sage.misc.package.list_packages,
         # which gives an error on Debian unstable as of 2019-12-27:
         # FileNotFoundError: [Errno 2] No such file or directory: '/usr/share/sagemath/build/pkgs'
-        errno = os.system("PYTHONPATH=`pwd` sage -t --force-lib --optional=sage sage_numerical_backends_coin")
-        if errno != 0:
+        self.run_sage(['-t', '--force-lib', '--optional=sage',
+                       '--nthreads={}'.format(int(os.environ.get('SAGE_NUM_THREADS_PARALLEL') or os.cpu_count() or 1)),
+                       'sage_numerical_backends_coin'])
+
+    def run_sage(self, args):
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        if subprocess.run(['sage'] + args, env=env).returncode != 0:
             sys.exit(1)
 
 class SageTestSage(SageTest):
+    # Records the hash of the extension that last passed; FORCE_TESTS=1 ignores it.
+    sentinel = os.path.join('build', '.last_test_ok')
+
     def run_tests(self):
-        errno = os.system("PYTHONPATH=`pwd` sage -c 'load(\"check_sage_testsuite.py\")'")
-        if errno != 0:
-            sys.exit(1)
+        so_hash = self.built_extension_hash()
+        if so_hash is not None and not int(os.environ.get('FORCE_TESTS', '0')):
+            if os.path.exists(self.sentinel) and readfile(self.sentinel) == so_hash:
+                print("Skipping the Sage testsuite: it already passed with this build of coin_backend",
+                      file=sys.stderr)
+                return
+        self.run_sage(['-c', 'load("check_sage_testsuite.py")'])
+        if so_hash is not None:
+            os.makedirs('build', exist_ok=True)
+            with open(self.sentinel, 'w') as f:
+                f.write(so_hash)
+
+    def built_extension_hash(self):
+        # None unless the in-place built extension is newer than its Cython sources.
+        pkg = 'sage_numerical_backends_coin'
+        sources = glob.glob(os.path.join(pkg, '*.pyx')) + glob.glob(os.path.join(pkg, '*.pxd'))
+        built = glob.glob(os.path.join(pkg, 'coin_backend*.so'))
+        if not built or max(map(os.path.getmtime, built)) < max(map(os.path.getmtime, sources)):
+            return None
+        # A pass on a narrowed selection of files does not count for the full testsuite,
+        # nor does a pass with a different version of the testsuite script or of Sage.
+        h = hashlib.sha1(sage.version.version.encode('utf-8') + b'\0')
+        for var in ('SAGE_TEST_FILES', 'SAGE_SKIP_FILES'):
+            h.update(os.environ.get(var, '').encode('utf-8') + b'\0')
+        for filename in ['check_sage_testsuite.py'] + sorted(built):
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+# Build extensions in parallel unless -j is given, and compile (but do not link)
+# through ccache if it is available; USE_CCACHE=0 disables the latter.
+class BuildExt(build_ext):
+    def finalize_options(self):
+        build_ext.finalize_options(self)
+        if self.parallel is None:
+            self.parallel = os.cpu_count() or 1
+
+    def build_extensions(self):
+        if int(os.environ.get('USE_CCACHE', '1')) and shutil.which('ccache'):
+            os.environ.setdefault('CCACHE_SLOPPINESS', 'pch_defines,time_macros')
+            for attr in ('compiler_so', 'compiler_so_cxx'):
+                cmd = getattr(self.compiler, attr, None)
+                if cmd and os.path.basename(cmd[0]) != 'ccache':
+                    setattr(self.compiler, attr, ['ccache'] + cmd)
+        build_ext.build_extensions(self)
+
+    def run(self):
+        build_ext.run(self)
+        # Only cache the probe results after a successful build, so that a probe
+        # that failed because of a broken environment is run again next time.
+        if probe_cache_pending:
+            os.makedirs('build', exist_ok=True)
+            with open(probe_cache, 'w') as f:
+                json.dump(compile_time_env, f)
 
 # Get information from separate files (README, VERSION)
 def readfile(filename):
@@ -35,11 +103,48 @@ def readfile(filename):
  # Cython modules
 import pkgconfig
 
-try:
-    cbc_pc = pkgconfig.parse('cbc')
-except pkgconfig.PackageNotFoundError:    # exception handling from sage trac #28883 for pkgconfig version 1.5.1
-    from collections import defaultdict
-    cbc_pc = defaultdict(list, {'libraries': ['Cbc']})
+def _cbc_pc_cache_key(pc_file, pc_dirs):
+    # Adding a .pc file to a directory changes the directory's mtime.
+    def mtime(path):
+        return os.path.getmtime(path) if os.path.exists(path) else None
+    return {'executable': sys.executable,
+            'pkg_config': shutil.which(os.environ.get('PKG_CONFIG', 'pkg-config')),
+            'search_path': [os.environ.get(var, '') for var in ('PKG_CONFIG_PATH', 'PKG_CONFIG_LIBDIR')],
+            'mtimes': [[path, mtime(path)] for path in [pc_file] + pc_dirs]}
+
+def _load_cbc_pc():
+    # The result of pkgconfig.parse is cached in build/.  It is reused for the same Python
+    # and pkg-config as long as neither the cbc.pc file that pkg-config used nor any
+    # directory on the pkg-config search path has changed.
+    # SAGE_FORCE_PROBE=1 ignores the cache.
+    cache = os.path.join('build', '.cbc_pc.json')
+    if os.path.exists(cache) and not int(os.environ.get('SAGE_FORCE_PROBE', '0')):
+        with open(cache) as f:
+            cached = json.load(f)
+        if ('pc_dirs' in cached
+                and cached['key'] == _cbc_pc_cache_key(cached['pc_file'], cached['pc_dirs'])):
+            return defaultdict(list, cached['cbc_pc'])
+
+    try:
+        cbc_pc = pkgconfig.parse('cbc')
+    except pkgconfig.PackageNotFoundError:    # exception handling from sage trac #28883 for pkgconfig version 1.5.1
+        # Not cached, so that the lookup is repeated once cbc is installed.
+        return defaultdict(list, {'libraries': ['Cbc']})
+    pc_file = os.path.join(pkgconfig.variables('cbc')['pcfiledir'], 'cbc.pc')
+    try:
+        pc_path = pkgconfig.variables('pkg-config').get('pc_path', '')
+    except pkgconfig.PackageNotFoundError:
+        pc_path = ''
+    search_path = [os.environ.get(var, '') for var in ('PKG_CONFIG_PATH', 'PKG_CONFIG_LIBDIR')]
+    pc_dirs = [d for path in search_path + [pc_path] for d in path.split(os.pathsep) if d]
+    if os.path.exists(pc_file):
+        os.makedirs('build', exist_ok=True)
+        with open(cache, 'w') as f:
+            json.dump({'key': _cbc_pc_cache_key(pc_file, pc_dirs),
+                       'pc_file': pc_file, 'pc_dirs': pc_dirs, 'cbc_pc': cbc_pc}, f)
+    return cbc_pc
+
+cbc_pc = _load_cbc_pc()
 
 if cbc_pc:
     print("Using pkgconfig: {}".format(sorted(cbc_pc.items())), file=sys.stderr)
@@ -47,6 +152,35 @@ cbc_libs = cbc_pc['libraries']
 cbc_library_dirs = cbc_pc['library_dirs']
 cbc_include_dirs = cbc_pc['include_dirs']
 
+# Release builds are optimized and stripped; SAGE_DEBUG_BUILD=1 keeps debugging information instead.
+debug = bool(int(os.environ.get('SAGE_DEBUG_BUILD', '0')))
+extra_compile_args = ['-std=c++11', '-fno-strict-aliasing']
+extra_link_args = []
+if debug:
+    extra_compile_args += ['-g']
+else:
+    extra_compile_args += ['-g0', '-O3', '-DNDEBUG']
+    if sys.platform == 'darwin':
+        # The macOS linker has no -O1 and has made -s obsolete; -S drops the debugging information.
+        extra_link_args += ['-Wl,-S']
+    else:
+        extra_link_args += ['-Wl,-O1', '-Wl,-s']
+
+# Link-time optimization is opt-in (USE_LTO=1); it only has an effect with a
+# static libCbc that was itself compiled with -flto.
+if int(os.environ.get('USE_LTO', '0')):
+    lto_flag = '-flto=thin' if sys.platform == 'darwin' else '-flto'
+    extra_compile_args.append(lto_flag)
+    extra_link_args.append(lto_flag)
+
+# Methods that index lists with user-supplied indices re-enable boundscheck locally.
+compiler_directives = {'boundscheck': False,
+                       'wraparound': False,
+                       'cdivision': True,
+                       'initializedcheck': False,
+                       'nonecheck': False,
+                       'language_level': 3,
+                       'embedsignature': False}
 
 ext_modules = [Extension('sage_numerical_backends_coin.coin_backend',
                          sources=[os.path.join('sage_numerical_backends_coin',
@@ -54,33 +188,50 @@ ext_modules = [Extension('sage_numerical_backends_coin.coin_backend',
                          libraries=cbc_libs,
                          include_dirs=sage_include_directories() + cbc_include_dirs,
                          library_dirs=cbc_library_dirs,
-                         extra_compile_args=['-std=c++11'])
+                         extra_compile_args=extra_compile_args,
+                         extra_link_args=extra_link_args)
     ]
 
 
-## SageMath 8.1 (included in Ubuntu bionic 18.04 LTS) does not have sage.cpython.string;
-## it was introduced in 8.2.
-compile_time_env = {'HAVE_SAGE_CPYTHON_STRING': False,
-                    'HAVE_ADD_COL_UNTYPED_ARGS': False}
-
-print("Checking whether HAVE_SAGE_CPYTHON_STRING...", file=sys.stderr)
-try:
-    import sage.cpython.string
-    compile_time_env['HAVE_SAGE_CPYTHON_STRING'] = True
-except ImportError:
-    pass
-
-## SageMath 8.7 changed the signature of add_col.
-print("Checking whether HAVE_ADD_COL_UNTYPED_ARGS...", file=sys.stderr)
-try:
-    cythonize(Extension('check_add_col_untyped_args',
-                        sources=['check_add_col_untyped_args.pyx'],
-                        include_dirs=sage_include_directories()),
-              quiet=True,
-              include_path=sys.path)
-    compile_time_env['HAVE_ADD_COL_UNTYPED_ARGS'] = True
-except CompileError:
-    pass
+## The probes below are cached in build/, keyed on the Sage and Python versions.
+## Set SAGE_FORCE_PROBE=1 to run them again.
+import sage.version
+probe_key = (sage.version.version, sys.version_info[:2], platform.machine())
+probe_cache = os.path.join('build', '.add_col_probe.{}.json'.format(
+    hashlib.sha1(repr(probe_key).encode('utf-8')).hexdigest()))
+
+probe_cache_pending = False
+if os.path.exists(probe_cache) and not int(os.environ.get('SAGE_FORCE_PROBE', '0')):
+    print("Using cached probe results from {} (set SAGE_FORCE_PROBE=1 to probe again)".format(probe_cache),
+          file=sys.stderr)
+    with open(probe_cache) as f:
+        compile_time_env = json.load(f)
+else:
+    ## SageMath 8.1 (included in Ubuntu bionic 18.04 LTS) does not have sage.cpython.string;
+    ## it was introduced in 8.2.
+    compile_time_env = {'HAVE_SAGE_CPYTHON_STRING': False,
+                        'HAVE_ADD_COL_UNTYPED_ARGS': False}
+
+    print("Checking whether HAVE_SAGE_CPYTHON_STRING...", file=sys.stderr)
+    try:
+        # find_spec locates the module without executing it.
+        compile_time_env['HAVE_SAGE_CPYTHON_STRING'] = importlib.util.find_spec('sage.cpython.string') is not None
+    except ImportError:
+        pass
+
+    ## SageMath 8.7 changed the signature of add_col.
+    print("Checking whether HAVE_ADD_COL_UNTYPED_ARGS...", file=sys.stderr)
+    try:
+        cythonize(Extension('check_add_col_untyped_args',
+                            sources=['check_add_col_untyped_args.pyx'],
+                            include_dirs=sage_include_directories()),
+                  quiet=True,
+                  include_path=sys.path)
+        compile_time_env['HAVE_ADD_COL_UNTYPED_ARGS'] = True
+    except CompileError:
+        pass
+
+    probe_cache_pending = True
 
 print("Using compile_time_env: {}".format(compile_time_env), file=sys.stderr)
 
@@ -102,10 +253,6 @@ setup(
                  'License :: OSI Approved :: GNU General Public License v2 or later (GPLv2+)',
                  "Programming Language :: Python",
                  'Programming Language :: Python :: 3',
-                 'Programming Language :: Python :: 3.4',
-                 'Programming Language :: Python :: 3.5',
-                 'Programming Language :: Python :: 3.6',
-                 'Programming Language :: Python :: 3.7',
                  'Programming Language :: Python :: 3.8',
                  'Programming Language :: Python :: 3.9',
                  'Programming Language :: Python :: 3.10',
@@ -113,8 +260,12 @@ setup(
                  'Programming Language :: Python :: 3.12',
                  ],
     ext_modules = cythonize(ext_modules, include_path=sys.path,
-                            compile_time_env=compile_time_env),
-    cmdclass = {'test': SageTest, 'check_sage_testsuite': SageTestSage}, # adding a special setup command for tests
+                            nthreads=os.cpu_count() or 1,
+                            compile_time_env=compile_time_env,
+                            compiler_directives=compiler_directives),
+    cmdclass = {'build_ext': BuildExt,
+                'test': SageTest, 'check_sage_testsuite': SageTestSage}, # adding a special setup command for tests
+    python_requires='>=3.8',
     keywords=['milp', 'linear-programming', 'optimization'],
     packages=['sage_numerical_backends_coin'],
     package_dir={'sage_numerical_backends_coin': 'sage_numerical_backends_coin'},